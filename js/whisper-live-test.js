@@ -1,11 +1,7 @@
 /**
  * Whisper.wasm Live Streaming Test Module
  */
-import { pipeline, env } from 'https://cdn.jsdelivr.net/npm/@huggingface/transformers@3.3.3';
-
-env.allowLocalModels = false;
-env.remoteModels = true;
-env.backends.onnx.wasm.wasmPaths = 'https://cdn.jsdelivr.net/npm/@huggingface/transformers@3.3.3/dist/';
+import { createTranscriber, createPartialStreamer, releaseTranscriber } from './whisper-pipeline.js?v=4';
 
 export class WhisperLiveTester {
     constructor() {
@@ -14,9 +10,10 @@ export class WhisperLiveTester {
         this.stream = null;
         this.processor = null;
         this.isRecording = false;
-        this.audioBuffer = []; 
         this.sampleRate = 16000;
         this.modelName = null;
+        this.transcribeOptions = null; // 모델 로드 시 한 번만 구성해 매 전사마다 재사용
+        this.debug = false;            // true면 오디오 블록/발화 단위 디버그 로그 출력 (기본 꺼짐)
 
         // VAD 설정
         this.vadThreshold = 0.01;       // 음성 감지 임계값 (볼륨)
@@ -24,30 +21,72 @@ export class WhisperLiveTester {
         this.maxBufferLength = 10;      // 최대 10초까지만 버퍼링 (너무 길어짐 방지)
         this.lastSpeakingTime = 0;     // 마지막으로 음성이 감지된 시간
         this.isSpeaking = false;       // 현재 말을 하고 있는 중인지 여부
+        this.minSpeechDuration = 150;  // 발화 중 실제 음성 구간이 이보다 짧으면 (잡음) 전사 생략
+        this.speechFrameSize = 512;    // 음성 구간 측정 단위 (16kHz 기준 32ms, "네" 같은 짧은 대답도 구분 가능)
+        this.speechSamples = 0;        // 현재 발화에서 임계값을 넘은 프레임의 샘플 수
+
+        this.blockSize = 4096;         // ScriptProcessor 블록 크기 (16kHz 기준 256ms)
+
+        // 발화 버퍼: startStreaming에서 현재 설정값으로 크기를 정하고, 크기가 같으면 그대로 재사용
+        // (maxBufferLength/blockSize 변경은 다음 startStreaming부터 적용)
+        this.maxSamples = 0;
+        this.pcmBuffer = null;
+        this.pcmLength = 0;
+
+        // 전사 대기열 (크기 1): 전사가 밀리면 오래된 대기 발화는 버리고 최신 발화를 우선
+        this.isTranscribing = false;
+        this.pendingUtterance = null;
+        this.drainPromise = null;      // 진행 중인 전사 루프 (모델 해제 전에 완료를 기다리기 위함)
     }
 
     async initModel(onProgress = null, modelName = 'Xenova/whisper-tiny') {
         if (this.transcriber && this.modelName === modelName) return;
+
+        // 다른 모델로 전환하는 경우 이전 모델은 먼저 해제해 두 모델이 동시에 메모리에 올라가지 않도록 함
+        // (현재 페이지 UI는 로드 후 모델 선택을 막아 두었으므로 이 경로는 직접 호출할 때만 사용됨)
+        if (this.transcriber) {
+            // 대기 중인 발화는 버리고 진행 중인 전사가 끝난 뒤에 해제해, 해제된 세션으로 전사하지 않도록 함
+            this.pendingUtterance = null;
+            if (this.drainPromise) await this.drainPromise;
+            const previous = this.transcriber;
+            this.transcriber = null;
+            await releaseTranscriber(previous);
+        }
         
         this.modelName = modelName;
+        this.transcribeOptions = this.buildTranscribeOptions(modelName);
+        const { transcriber, device, dtype } = await createTranscriber(modelName, onProgress, this.transcribeOptions);
+        console.log(`[LiveWhisper] 실행 환경: ${device} / ${dtype}`);
+
+        this.transcriber = transcriber;
+    }
+
+    buildTranscribeOptions(modelName) {
+        // 모델별 파라미터 조정
         const options = {
-            progress_callback: onProgress
+            task: 'transcribe',
+            return_timestamps: false,
+            // greedy 디코딩 (Transformers.js 3.3.3은 beam search를 구현하지 않으므로 명시적으로 1 고정)
+            num_beams: 1,
+            do_sample: false
         };
-        
-        // GPU 지원 확인
-        if (navigator.gpu) {
-            options.device = 'webgpu';
-            if (modelName.includes('large')) options.dtype = 'fp16';
-        }
 
-        this.transcriber = await pipeline('automatic-speech-recognition', modelName, options);
+        // Whisper 모델일 때만 언어 설정 (Moonshine 등은 지원 안 할 수 있음)
+        // 발화는 최대 maxBufferLength(10초)로 잘리므로 30초 창 하나로 충분: chunk/stride를 지정하지 않아
+        // 청크 분할·중첩 구간 재디코딩 없이 한 번의 디코딩으로 끝냄
+        if (modelName.includes('whisper')) {
+            options.language = 'korean';
+        }
+        return options;
     }
 
     async startStreaming(callback) {
         if (this.isRecording) return;
         
         this.isRecording = true;
-        this.audioBuffer = [];
+        this.allocatePcmBuffer();
+        this.pcmLength = 0;
+        this.speechSamples = 0;
         this.isSpeaking = false;
         this.lastSpeakingTime = Date.now();
         
@@ -57,7 +96,7 @@ export class WhisperLiveTester {
         });
         
         const source = this.audioContext.createMediaStreamSource(this.stream);
-        this.processor = this.audioContext.createScriptProcessor(4096, 1, 1);
+        this.processor = this.audioContext.createScriptProcessor(this.blockSize, 1, 1);
         
         source.connect(this.processor);
         this.processor.connect(this.audioContext.destination);
@@ -67,15 +106,26 @@ export class WhisperLiveTester {
             
             const inputData = e.inputBuffer.getChannelData(0);
             
-            // 1. 에너지(볼륨) 계산
+            // 1. 에너지(볼륨) 계산: 블록 전체 RMS와 함께, 같은 루프에서 32ms 프레임마다
+            //    임계값을 넘은 샘플 수를 세어 블록(256ms)보다 짧은 음성 구간도 측정
+            const frameSize = this.speechFrameSize;
+            const frameThreshold = this.vadThreshold * this.vadThreshold * frameSize;
             let sum = 0;
+            let frameSum = 0;
+            let loudSamples = 0;
             for (let i = 0; i < inputData.length; i++) {
-                sum += inputData[i] * inputData[i];
+                const energy = inputData[i] * inputData[i];
+                sum += energy;
+                frameSum += energy;
+                if ((i + 1) % frameSize === 0) {
+                    if (frameSum > frameThreshold) loudSamples += frameSize;
+                    frameSum = 0;
+                }
             }
             const rms = Math.sqrt(sum / inputData.length);
 
-            // 볼륨 모니터링을 위해 가끔씩 로그 출력
-            if (Math.random() < 0.05) {
+            // 볼륨 모니터링을 위해 가끔씩 로그 출력 (디버그 모드에서만)
+            if (this.debug && Math.random() < 0.05) {
                 console.log(`[VAD Debug] RMS: ${rms.toFixed(4)}, Threshold: ${this.vadThreshold}`);
             }
 
@@ -84,7 +134,7 @@ export class WhisperLiveTester {
             // 2. 음성 활동 감지 로직
             if (rms > this.vadThreshold) {
                 if (!this.isSpeaking) {
-                    console.log('[VAD] 음성 감지 시작');
+                    if (this.debug) console.log('[VAD] 음성 감지 시작');
                     this.isSpeaking = true;
                 }
                 this.lastSpeakingTime = now;
@@ -92,58 +142,103 @@ export class WhisperLiveTester {
 
             // 3. 버퍼링
             if (this.isSpeaking) {
-                this.audioBuffer.push(...inputData);
+                this.speechSamples += loudSamples;
+                // 최대 길이에 도달하면 바로 비우므로 블록 하나는 항상 남은 공간에 들어감
+                this.pcmBuffer.set(inputData, this.pcmLength);
+                this.pcmLength += inputData.length;
 
                 const silenceElapsed = now - this.lastSpeakingTime;
-                const bufferSeconds = this.audioBuffer.length / this.sampleRate;
 
-                if (silenceElapsed > this.silenceDuration || bufferSeconds > this.maxBufferLength) {
-                    console.log(`[VAD] 문장 종료 감지 (침묵: ${silenceElapsed}ms, 버퍼: ${bufferSeconds.toFixed(1)}s)`);
+                if (silenceElapsed > this.silenceDuration || this.pcmLength >= this.maxSamples) {
+                    if (this.debug) {
+                        const bufferSeconds = this.pcmLength / this.sampleRate;
+                        console.log(`[VAD] 문장 종료 감지 (침묵: ${silenceElapsed}ms, 버퍼: ${bufferSeconds.toFixed(1)}s)`);
+                    }
                     this.isSpeaking = false;
-                    const bufferToProcess = [...this.audioBuffer];
-                    this.audioBuffer = []; 
-                    
-                    this.processBuffer(bufferToProcess, callback);
+                    const length = this.pcmLength;
+                    const speechMs = this.speechSamples / this.sampleRate * 1000;
+                    this.pcmLength = 0;
+                    this.speechSamples = 0;
+
+                    // 박수, 키보드 소리처럼 순간적인 잡음만 있었다면 모델을 호출하지 않음
+                    if (speechMs < this.minSpeechDuration) {
+                        if (this.debug) console.log(`[VAD] 음성 구간이 짧아 전사 생략 (${speechMs.toFixed(0)}ms)`);
+                        return;
+                    }
+
+                    // 전사는 비동기로 진행되므로 현재 발화만 복사해 넘기고 버퍼는 바로 재사용
+                    const bufferToProcess = this.pcmBuffer.slice(0, length);
+                    this.enqueueBuffer(bufferToProcess, callback);
                 }
             }
         };
     }
 
+    allocatePcmBuffer() {
+        this.maxSamples = this.sampleRate * this.maxBufferLength;
+        // 최대 길이에 도달한 블록도 잘리지 않도록 오디오 블록 하나만큼 여유를 둠
+        const capacity = this.maxSamples + this.blockSize;
+        if (!this.pcmBuffer || this.pcmBuffer.length !== capacity) {
+            this.pcmBuffer = new Float32Array(capacity);
+        }
+    }
+
+    async enqueueBuffer(buffer, callback) {
+        if (this.isTranscribing) {
+            if (this.pendingUtterance) {
+                console.warn('[LiveWhisper] 전사 지연으로 대기 중이던 이전 발화를 건너뜁니다.');
+            }
+            this.pendingUtterance = { buffer, callback };
+            return;
+        }
+
+        this.isTranscribing = true;
+        this.drainPromise = (async () => {
+            try {
+                let next = { buffer, callback };
+                while (next) {
+                    await this.processBuffer(next.buffer, next.callback);
+                    next = this.pendingUtterance;
+                    this.pendingUtterance = null;
+                }
+            } finally {
+                this.isTranscribing = false;
+                this.drainPromise = null;
+            }
+        })();
+        return this.drainPromise;
+    }
+
     async processBuffer(buffer, callback) {
         if (buffer.length < this.sampleRate * 0.5) return; 
+        if (!this.transcriber) return; // 모델 전환 중
 
         try {
-            const currentData = new Float32Array(buffer);
-            
-            // 모델별 파라미터 조정
-            const options = {
-                task: 'transcribe',
-                return_timestamps: false
-            };
-
-            // Whisper 모델일 때만 언어 설정 (Moonshine 등은 지원 안 할 수 있음)
-            if (this.modelName.includes('whisper')) {
-                options.language = 'korean';
-                options.chunk_length_s = 30;
-                options.stride_length_s = 5;
-            }
-
-            console.log(`[LiveWhisper] 전사 요청 (${this.modelName})...`);
-            const output = await this.transcriber(currentData, options);
-            console.log('[LiveWhisper] raw output:', output);
+            if (this.debug) console.log(`[LiveWhisper] 전사 요청 (${this.modelName})...`);
+            // 디코딩이 끝나기 전에도 부분 결과를 바로 화면에 표시
+            const streamer = createPartialStreamer(this.transcriber, (partial) => callback(partial, false));
+            const output = await this.transcriber(buffer, { ...this.transcribeOptions, streamer });
+            if (this.debug) console.log('[LiveWhisper] raw output:', output);
 
             const text = typeof output === 'string' ? output : (output.text || '');
             if (text.trim()) {
                 callback(text, true);
             } else {
                 console.warn('[LiveWhisper] 전사 결과가 비어있습니다.');
+                this.clearPartial(callback);
             }
         } catch (err) {
             console.error('[LiveWhisper] Process Error:', err);
             // 에러를 UI로 전달할 수 있는 콜백이 있으면 좋겠지만 일단 콘솔 로그 강화
+            this.clearPartial(callback);
         }
     }
 
+    // 최종 결과 없이 끝난 경우 화면에 남은 부분 결과('...')를 지움 (빈 부분 결과 = 표시 초기화)
+    clearPartial(callback) {
+        callback('', false);
+    }
+
     stopStreaming() {
         this.isRecording = false;
         if (this.processor) {
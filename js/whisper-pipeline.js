@@ -0,0 +1,155 @@
+/**
+ * Whisper (Transformers.js) 공통 파이프라인 모듈
+ * whisper-test.js / whisper-live-test.js가 함께 사용하는 환경 설정과 모델 생성 로직
+ */
+
+const TRANSFORMERS_URL = 'https://cdn.jsdelivr.net/npm/@huggingface/transformers@3.3.3';
+
+// Transformers.js(ONNX Runtime 포함 수 MB)는 페이지 로드 시점이 아니라 첫 모델 로드 시점에 동적으로 가져옴
+let transformersModule = null;
+let transformersLoading = null;
+
+function loadTransformers() {
+    if (!transformersLoading) {
+        transformersLoading = import(TRANSFORMERS_URL).then((module) => {
+            const { env } = module;
+
+            // 핵심: 라이브러리가 로컬 서버가 아닌 CDN에서 직접 모델과 WASM을 가져오도록 강제 설정
+            env.allowLocalModels = false;
+            env.allowRemoteModels = true;
+            env.useBrowserCache = true; // 최초 1회만 내려받고 이후에는 브라우저 캐시에서 로드
+            // v3에서는 WASM 경로 설정 방식이 약간 다를 수 있으나 기본적으로 CDN을 사용하도록 설정
+            env.backends.onnx.wasm.wasmPaths = `${TRANSFORMERS_URL}/dist/`;
+            // WASM 스레드 수를 명시적으로 지정 (ONNX Runtime 기본값과 동일한 규칙):
+            // 논리 코어 수(hardwareConcurrency)의 절반 올림, 최대 4
+            // SharedArrayBuffer를 쓸 수 없는 (crossOriginIsolated가 아닌) 페이지에서는 단일 스레드이며,
+            // 현재 COOP/COEP 헤더를 보내는 페이지가 없으므로 실제로는 항상 1
+            env.backends.onnx.wasm.numThreads = self.crossOriginIsolated
+                ? Math.min(4, Math.ceil((navigator.hardwareConcurrency || 1) / 2))
+                : 1;
+            console.log(`[WhisperPipeline] WASM 스레드 수: ${env.backends.onnx.wasm.numThreads} (논리 코어: ${navigator.hardwareConcurrency})`);
+
+            transformersModule = module;
+            return module;
+        }).catch((error) => {
+            // 네트워크 오류 등으로 실패하면 다음 호출에서 다시 시도
+            transformersLoading = null;
+            throw error;
+        });
+    }
+    return transformersLoading;
+}
+
+/**
+ * WebGPU 어댑터 확인 (shader-f16 지원 여부 포함)
+ * 어댑터를 얻지 못하면 null을 반환하며, 이 경우 WASM(CPU)으로 동작
+ */
+async function probeWebGPU() {
+    if (!navigator.gpu) return null;
+    const adapter = await navigator.gpu.requestAdapter();
+    if (!adapter) return null;
+    return { shaderF16: adapter.features.has('shader-f16') };
+}
+
+/**
+ * WebGPU에서 사용할 모듈별 dtype 선택
+ * - decoder_model_merged는 fp16에서 결과가 깨지므로 항상 fp32 (Transformers.js WebGPU Whisper 예제와 동일)
+ * - encoder_model은 메모리 부담이 큰 Large 모델이고 어댑터가 shader-f16을 지원할 때만 fp16
+ * - Tiny/Base 및 Moonshine은 기존과 같이 전부 fp32
+ */
+function pickWebGPUDtype(modelName, shaderF16) {
+    const encoder = shaderF16 && modelName.includes('large') ? 'fp16' : 'fp32';
+    return { encoder_model: encoder, decoder_model_merged: 'fp32' };
+}
+
+// 로그 출력용 dtype 표기 ('q8' 또는 'encoder_model=fp16, decoder_model_merged=fp32')
+function describeDtype(dtype) {
+    if (typeof dtype === 'string') return dtype;
+    return Object.entries(dtype).map(([name, type]) => `${name}=${type}`).join(', ');
+}
+
+/**
+ * 기기에 맞는 device/dtype으로 음성 인식 파이프라인 생성
+ * 생성한 파이프라인은 호출한 테스터가 소유하며, 필요 없어지면 releaseTranscriber로 해제
+ * @param {string} modelName - Hugging Face 모델 ID
+ * @param {Function|null} onProgress - 다운로드 진행 콜백
+ * @param {Object} warmupOptions - 예열 실행에 쓸 전사 옵션 (language/task 등, 실제 전사와 같은 경로를 예열)
+ * @returns {Promise<{transcriber: Function, device: string, dtype: string}>}
+ */
+export async function createTranscriber(modelName, onProgress = null, warmupOptions = {}) {
+    const { pipeline } = await loadTransformers();
+    const options = {
+        progress_callback: (progress) => {
+            if (onProgress) onProgress(progress);
+        }
+    };
+
+    // WebGPU 사용 가능 여부 확인 후 모듈별 dtype 선택
+    let gpu = null;
+    try {
+        gpu = await probeWebGPU();
+    } catch (e) {
+        console.warn('[WhisperPipeline] WebGPU 체크 중 오류:', e);
+    }
+
+    if (gpu) {
+        options.device = 'webgpu';
+        options.dtype = pickWebGPUDtype(modelName, gpu.shaderF16);
+    } else {
+        // CPU(WASM)에서는 가중치만 int8로 양자화된 모델 사용 (활성값은 fp32 유지)
+        options.dtype = 'q8';
+    }
+
+    const transcriber = await pipeline('automatic-speech-recognition', modelName, options);
+
+    // WebGPU에서만 1초 무음으로 한 번 실행해 두어 셰이더 컴파일, GPU 버퍼 할당 같은 초기화 비용을
+    // 첫 사용자 발화가 아닌 로드 단계에서 치르도록 함
+    // (WASM은 세션 초기화가 pipeline() 안에서 이미 끝나고 컴파일할 셰이더도 없어, 예열은 30초 창
+    //  인코더 연산만 한 번 더 하는 셈이므로 생략. Large 모델은 CPU에서 로드가 수 초 늘어남)
+    // - 실제 전사와 같은 language/task를 사용 (미지정 시 언어 감지 경로와 경고 로그가 발생)
+    // - 토큰 2개를 생성해 past KV 캐시를 쓰는 디코더 경로까지 예열
+    if (options.device === 'webgpu') {
+        try {
+            const start = performance.now();
+            await transcriber(new Float32Array(16000), { ...warmupOptions, max_new_tokens: 2 });
+            console.log(`[WhisperPipeline] 모델 예열 완료 (${(performance.now() - start).toFixed(0)}ms)`);
+        } catch (e) {
+            console.warn('[WhisperPipeline] 모델 예열 실패 (무시하고 계속):', e);
+        }
+    }
+
+    return { transcriber, device: options.device || 'wasm', dtype: describeDtype(options.dtype) };
+}
+
+/**
+ * 파이프라인을 해제해 ONNX 세션과 GPU/WASM 메모리를 반환
+ * 다른 모델로 전환할 때 이전 모델을 메모리에 함께 남겨두지 않기 위해 사용
+ * @param {Function} transcriber - createTranscriber로 만든 파이프라인
+ */
+export async function releaseTranscriber(transcriber) {
+    try {
+        await transcriber.dispose();
+        console.log('[WhisperPipeline] 모델 메모리 해제 완료');
+    } catch (e) {
+        console.warn('[WhisperPipeline] 모델 해제 중 오류:', e);
+    }
+}
+
+/**
+ * 디코딩 중 토큰이 나올 때마다 지금까지의 부분 결과를 전달하는 스트리머 생성
+ * 전사 호출 옵션의 streamer로 넘기면 전체 디코딩이 끝나기 전에 중간 결과를 표시할 수 있음
+ * @param {Function} transcriber - createTranscriber로 만든 파이프라인
+ * @param {Function} onPartial - (partialText) => void
+ */
+export function createPartialStreamer(transcriber, onPartial) {
+    let partial = '';
+    // 스트리머는 모델 로드 이후에만 만들어지므로 이 시점에는 모듈이 이미 로드되어 있음
+    return new transformersModule.TextStreamer(transcriber.tokenizer, {
+        skip_prompt: true,
+        skip_special_tokens: true,
+        callback_function: (text) => {
+            partial += text;
+            if (partial.trim()) onPartial(partial);
+        }
+    });
+}
@@ -2,55 +2,97 @@
  * Whisper.wasm (Transformers.js) Test Module
  */
 
-import { pipeline, env } from 'https://cdn.jsdelivr.net/npm/@huggingface/transformers@3.3.3';
+import { createTranscriber, releaseTranscriber } from './whisper-pipeline.js?v=4';
 
-// 핵심: 라이브러리가 로컬 서버가 아닌 CDN에서 직접 모델과 WASM을 가져오도록 강제 설정
-env.allowLocalModels = false;
-env.remoteModels = true;
-// v3에서는 WASM 경로 설정 방식이 약간 다를 수 있으나 기본적으로 CDN을 사용하도록 설정
-env.backends.onnx.wasm.wasmPaths = 'https://cdn.jsdelivr.net/npm/@huggingface/transformers@3.3.3/dist/';
+const SAMPLE_RATE = 16000; // Whisper 입력 샘플레이트
+
+const METADATA_TIMEOUT_MS = 3000; // 메타데이터 이벤트를 기다리는 최대 시간
+
+/**
+ * 디코딩 없이 <audio> 메타데이터만 읽어 재생 길이(초)를 반환
+ * 길이를 알 수 없는 경우 (일부 webm 등 Infinity, 메타데이터 오류) null 반환
+ * 사용자 제스처 없이는 메타데이터를 읽지 않는 브라우저(iOS Safari 등)나 로딩이 멈춘 경우에도
+ * 멈추지 않도록 일정 시간이 지나면 null 반환 (이 경우 파일 크기 제한만 적용)
+ */
+function readMediaDuration(url) {
+    return new Promise((resolve) => {
+        const audio = new Audio();
+        audio.preload = 'metadata';
+        let timer = null;
+        const finish = (duration) => {
+            clearTimeout(timer);
+            // src 해제 시 발생하는 이벤트로 다시 호출되지 않도록 핸들러부터 제거
+            audio.onloadedmetadata = null;
+            audio.onerror = null;
+            audio.removeAttribute('src');
+            audio.load();
+            resolve(Number.isFinite(duration) ? duration : null);
+        };
+        audio.onloadedmetadata = () => finish(audio.duration);
+        audio.onerror = () => finish(null);
+        timer = setTimeout(() => finish(null), METADATA_TIMEOUT_MS);
+        audio.src = url;
+    });
+}
+
+/**
+ * 다채널 오디오를 한 번의 루프로 평균 내어 모노 Float32Array로 변환
+ * (모노 입력은 복사 없이 그대로 반환)
+ */
+function downmixToMono(audioBuffer) {
+    const channels = audioBuffer.numberOfChannels;
+    if (channels === 1) return audioBuffer.getChannelData(0);
+
+    const length = audioBuffer.length;
+    const mono = new Float32Array(length);
+    const scale = 1 / channels;
+    for (let c = 0; c < channels; c++) {
+        const data = audioBuffer.getChannelData(c);
+        for (let i = 0; i < length; i++) {
+            mono[i] += data[i] * scale;
+        }
+    }
+    return mono;
+}
 
 export class WhisperTester {
     constructor() {
         this.transcriber = null;
         this.isModelLoading = false;
         this.currentModelName = null;
+        this.decodeContext = null;
+
+        // 입력 크기 제한: 재생 길이는 디코딩 전에 메타데이터로 확인하고,
+        // 길이를 알 수 없는 파일은 파일 크기로만 제한
+        this.maxDurationSec = 30 * 60;         // 30분
+        this.maxFileBytes = 100 * 1024 * 1024; // 100MB
     }
 
     async initModel(onProgress = null, modelName = 'Xenova/whisper-tiny') {
         // 이미 같은 모델이 로드되어 있다면 재사용
         if (this.transcriber && this.currentModelName === modelName) return true;
+
+        // 다른 모델로 전환하는 경우 이전 모델은 먼저 해제해 두 모델이 동시에 메모리에 올라가지 않도록 함
+        // (현재 페이지 UI는 로드 후 모델 선택을 막아 두었으므로 이 경로는 직접 호출할 때만 사용됨)
+        if (this.transcriber) {
+            const previous = this.transcriber;
+            this.transcriber = null;
+            await releaseTranscriber(previous);
+        }
         
         try {
             this.isModelLoading = true;
             this.currentModelName = modelName;
             console.log(`[WhisperTest] 모델 로딩 시작: ${modelName}`);
             
-            const options = {
-                progress_callback: (progress) => {
-                    if (onProgress) onProgress(progress);
-                }
-            };
-
-            // Large 모델의 경우 메모리 절약을 위해 fp16 또는 q8 권장
-            if (modelName.includes('large')) {
-                options.dtype = 'fp16'; 
-            }
-
-            // WebGPU 사용 가능 여부 확인 및 설정 시도
-            try {
-                if (navigator.gpu) {
-                    console.log('[WhisperTest] WebGPU 감지됨. 사용을 시도합니다.');
-                    options.device = 'webgpu';
-                }
-            } catch (e) {
-                console.warn('[WhisperTest] WebGPU 체크 중 오류:', e);
-            }
-            
-            this.transcriber = await pipeline('automatic-speech-recognition', modelName, options);
+            const { transcriber, device, dtype } = await createTranscriber(modelName, onProgress, {
+                language: 'korean',
+                task: 'transcribe'
+            });
+            this.transcriber = transcriber;
             
             this.isModelLoading = false;
-            console.log(`[WhisperTest] 모델 로딩 완료: ${modelName} (${options.device || 'cpu'})`);
+            console.log(`[WhisperTest] 모델 로딩 완료: ${modelName} (${device} / ${dtype})`);
             return true;
         } catch (error) {
             this.isModelLoading = false;
@@ -63,6 +105,9 @@ export class WhisperTester {
 
     async transcribe(audioData) {
         if (!this.transcriber) throw new Error('모델이 초기화되지 않았습니다.');
+        if (audioData.length > this.maxDurationSec * SAMPLE_RATE) {
+            throw new Error(`오디오가 너무 깁니다. (최대 ${this.maxDurationSec / 60}분)`);
+        }
 
         try {
             console.log('[WhisperTest] 전사 시작...', { 
@@ -75,6 +120,9 @@ export class WhisperTester {
                 language: 'korean',
                 task: 'transcribe',
                 return_timestamps: false,
+                // greedy 디코딩 (Transformers.js 3.3.3은 beam search를 구현하지 않으므로 명시적으로 1 고정)
+                num_beams: 1,
+                do_sample: false,
                 chunk_length_s: 30, // 30초 단위로 나누어 처리 (메모리 절약)
                 stride_length_s: 5,  // 청크 간 5초 중첩 (경계 정확도)
             });
@@ -106,11 +154,39 @@ export class WhisperTester {
         }
     }
 
-    async prepareAudio(audioUrl) {
-        const response = await fetch(audioUrl);
-        const arrayBuffer = await response.arrayBuffer();
-        const audioContext = new (window.AudioContext || window.webkitAudioContext)({ sampleRate: 16000 });
-        const audioBuffer = await audioContext.decodeAudioData(arrayBuffer);
-        return audioBuffer.getChannelData(0);
+    /**
+     * 오디오 파일을 16kHz Float32 PCM으로 한 번만 디코딩/리샘플링
+     * @param {Blob|string} source - File/Blob 또는 오디오 URL
+     */
+    async prepareAudio(source) {
+        if (source instanceof Blob && source.size > this.maxFileBytes) {
+            throw new Error(`파일이 너무 큽니다. (${(source.size / 1024 / 1024).toFixed(1)}MB, 최대 ${this.maxFileBytes / 1024 / 1024}MB)`);
+        }
+
+        // 압축 포맷(mp3/opus 등)은 작은 파일도 디코딩하면 수 GB의 PCM이 될 수 있으므로 디코딩 전에 길이 확인
+        const mediaUrl = source instanceof Blob ? URL.createObjectURL(source) : source;
+        let durationSec;
+        try {
+            durationSec = await readMediaDuration(mediaUrl);
+        } finally {
+            if (source instanceof Blob) URL.revokeObjectURL(mediaUrl);
+        }
+        if (durationSec !== null && durationSec > this.maxDurationSec) {
+            throw new Error(`오디오가 너무 깁니다. (${(durationSec / 60).toFixed(1)}분, 최대 ${this.maxDurationSec / 60}분)`);
+        }
+
+        const arrayBuffer = source instanceof Blob
+            ? await source.arrayBuffer()
+            : await (await fetch(source)).arrayBuffer();
+        if (arrayBuffer.byteLength > this.maxFileBytes) {
+            throw new Error(`파일이 너무 큽니다. (최대 ${this.maxFileBytes / 1024 / 1024}MB)`);
+        }
+
+        // 디코딩 전용 컨텍스트는 재생 장치를 점유하지 않는 OfflineAudioContext를 한 번만 만들어 재사용
+        if (!this.decodeContext) {
+            this.decodeContext = new OfflineAudioContext(1, 1, SAMPLE_RATE);
+        }
+        const audioBuffer = await this.decodeContext.decodeAudioData(arrayBuffer);
+        return downmixToMono(audioBuffer);
     }
 }